@@ -1,73 +1,284 @@
 import os
 import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache, partial, wraps
 import gradio as gr
-from transformers import pipeline
-from sentence_transformers import SentenceTransformer, util
-import PyPDF2
-
-# Set up logging with immediate writing
-logging.basicConfig(
-    filename='support_bot_log.txt',
-    level=logging.INFO,
-    format='%(asctime)s - %(message)s',
-    force=True  # Ensures any existing handlers are replaced and logging starts fresh
-)
+import numpy as np
+from retrieval import (DIRECT_ANSWER_THRESHOLD, EMBEDDER_MODEL_ID, EMBEDDER_ONNX_FILE, build_keyword_index, closest_rival,
+                       cosine_similarities, embed_query, encode_sections, iter_pdf_sections, leading_sentence, load_embedder,
+                       load_qa_model, normalize_query, search_matrix, section_word_set, setup_logging, similarity_buffer)
+
+try:
+    from blake3 import blake3 as content_hash
+    CONTENT_HASH_NAME = "blake3"
+except ImportError:
+    from hashlib import blake2b as content_hash
+    CONTENT_HASH_NAME = "blake2b"
+
+# Set up logging: handlers only enqueue records, and a background listener thread writes them to the log file
+log_listener, log_file_handler = setup_logging('support_bot_log.txt', format='%(asctime)s - %(message)s')
+log_flush_lock = threading.Lock()
 logger = logging.getLogger()
 
-# Load models
-qa_model = pipeline("question-answering", model="distilbert-base-uncased-distilled-squad") # Load the Hugging Face QA model for extracting answers from retrieved context.
-embedder = SentenceTransformer('all-MiniLM-L6-v2') # Loading SentenceTransformer to convert text into vector embeddings for cosine similarity search.
+EMBEDDING_CACHE_PATH = "embedding_cache.sqlite3" # Section embeddings persisted across uploads, sessions and restarts.
+EMBEDDING_CACHE_MAX_ROWS = 50_000 # About 75 MB of 384-dim vectors; the least recently used rows beyond this are deleted.
+QA_MAX_BATCH_SIZE = 8 # Upper bound on questions sharing one QA forward pass; a constant, so startup never imports torch to probe for a GPU.
+
+# Load models on first use rather than at import, so the app starts serving right away and an idle Space stays small.
+
+def load_once(loader):
+    """
+    Wraps a zero-argument loader so it runs at most once. The upload and query events run in separate Gradio worker
+    threads, so the first calls can race; a double-checked lock makes the losers wait for the winner's result.
+    """
+    lock = threading.Lock()
+    loaded = []
+
+    @wraps(loader)
+    def get():
+        if not loaded: # Skips the lock once loaded.
+            with lock:
+                if not loaded:
+                    loaded.append(loader())
+        return loaded[0]
+    return get
+
+@load_once
+def get_qa():
+    """The Hugging Face QA model for extracting answers from retrieved context."""
+    return load_qa_model()
+
+@load_once
+def get_embedder():
+    """The SentenceTransformer that converts text into vector embeddings for cosine similarity search."""
+    return load_embedder()
+
+# Embedding cache
+
+class EmbeddingCache:
+    """
+    SQLite-backed store of normalized float32 embeddings keyed by a hash of the text, bounded to max_rows by evicting
+    the least recently used rows.
+    Entries are namespaced by everything that determines a stored vector or its key (see embedding_namespace), so switching
+    models, backends or hash functions never returns stale vectors.
+    """
+
+    def __init__(self, path, namespace, max_rows):
+        self.namespace = namespace
+        self.max_rows = max_rows
+        self.conn = sqlite3.connect(path, check_same_thread=False) # Gradio calls handlers from worker threads; access is serialized by the lock.
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (namespace TEXT, key TEXT, vector BLOB, last_used INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (namespace, key))")
+            if "last_used" not in [column[1] for column in self.conn.execute("PRAGMA table_info(embeddings)")]: # Cache files from before eviction.
+                self.conn.execute("ALTER TABLE embeddings ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    def get_or_compute_many(self, texts, compute):
+        """
+        Returns one embedding row per text, calling compute(list_of_texts) once for all cache misses.
+        Repeated texts (headers, footers, boilerplate) share a key, so each distinct text is looked up and encoded only once.
+        """
+        keys = [content_hash(text.encode('utf-8')).hexdigest() for text in texts]
+        unique_texts = dict(zip(keys, texts)) # Distinct key -> text, in order of first occurrence.
+        unique_keys = list(unique_texts)
+        found = {}
+        now = int(time.time())
+        with self.lock, self.conn:
+            for start in range(0, len(unique_keys), 500): # Stay below SQLite's limit on bound parameters.
+                chunk = unique_keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE namespace = ? AND key IN ({placeholders})",
+                    [self.namespace, *chunk],
+                )
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+                self.conn.execute(f"UPDATE embeddings SET last_used = ? WHERE namespace = ? AND key IN ({placeholders})", [now, self.namespace, *chunk])
+
+        missing = [key for key in unique_keys if key not in found]
+        if missing:
+            computed = np.asarray(compute([unique_texts[key] for key in missing]), dtype=np.float32)
+            found.update(zip(missing, computed))
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (namespace, key, vector, last_used) VALUES (?, ?, ?, ?)",
+                    [(self.namespace, key, vector.tobytes(), now) for key, vector in zip(missing, computed)],
+                )
+                self._evict()
+        logger.info("Embedding cache: %s sections, %s unique (%.1f%% duplicates), %s hits, %s encoded",
+                    len(keys), len(unique_keys), 100 * (1 - len(unique_keys) / max(len(keys), 1)), len(unique_keys) - len(missing), len(missing))
+        return np.stack([found[key] for key in keys])
+
+    def _evict(self):
+        """Deletes the least recently used rows beyond max_rows (only run after inserts, the only way the store grows)."""
+        excess = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_rows
+        if excess > 0:
+            self.conn.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+            logger.info("Embedding cache: evicted %s least recently used rows", excess)
+
+def embedding_namespace(embedder):
+    """Names the model, the backend and weights file it runs (int8 ONNX or FP32 PyTorch), the embedding size and the key hash."""
+    backend = getattr(embedder, "backend", "torch")
+    weights = EMBEDDER_ONNX_FILE if backend == "onnx" else "fp32"
+    return f"{EMBEDDER_MODEL_ID}/{backend}/{weights}/{embedder.get_sentence_embedding_dimension()}/{CONTENT_HASH_NAME}"
+
+@load_once
+def get_embedding_cache():
+    return EmbeddingCache(EMBEDDING_CACHE_PATH, embedding_namespace(get_embedder()), EMBEDDING_CACHE_MAX_ROWS)
+
+# Answer cache
+
+class AnswerCache:
+    """
+    Thread-safe LRU of QA answers keyed by (normalized question, context hash).
+    Keys depend only on content, so the cache is shared by all sessions and never needs invalidating on upload.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, answer):
+        with self.lock:
+            self.entries[key] = answer
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+answer_cache = AnswerCache(maxsize=512)
+
+def answer_key(question, context):
+    return normalize_query(question), content_hash(context.encode('utf-8')).hexdigest()[:16]
+
+# Hand-off to the batched QA step
+
+class PendingQuestions:
+    """
+    Server-side hand-off between handle_input, the batched _answer step and finish_answer.
+    Only an opaque id travels through the page, so the QA step never runs on, or records, text sent back by the client.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.questions = OrderedDict() # id -> (question, context), waiting for the QA model
+        self.answers = OrderedDict() # id -> answer, waiting for finish_answer
+        self.lock = threading.Lock()
+
+    def _put(self, entries, pending_id, value):
+        entries[pending_id] = value
+        if len(entries) > self.maxsize: # Drops hand-offs abandoned by sessions that disconnected mid-chain.
+            entries.popitem(last=False)
+
+    def add(self, question, context):
+        pending_id = uuid.uuid4().hex
+        with self.lock:
+            self._put(self.questions, pending_id, (question, context))
+        return pending_id
+
+    def claim(self, pending_ids):
+        """Removes and returns {id: (question, context)} for the ids still waiting, so each question is answered once."""
+        with self.lock:
+            return {pending_id: self.questions.pop(pending_id) for pending_id in pending_ids if pending_id in self.questions}
+
+    def complete(self, pending_id, answer):
+        with self.lock:
+            self._put(self.answers, pending_id, answer)
+
+    def pop_answer(self, pending_id):
+        with self.lock:
+            return self.answers.pop(pending_id, None)
+
+pending_questions = PendingQuestions(maxsize=1024)
 
-# Helper function to extract text from PDF
-def extract_text_from_pdf(file_path):
-    text = ""
-    with open(file_path, "rb") as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n" # Extract text from each page and concatenate.
-    return text
+# Query embeddings only depend on the text, so repeated questions skip the embedder entirely.
+
+@lru_cache(maxsize=1024)
+def _encode_query(query_norm):
+    return embed_query(get_embedder(), query_norm)
+
+# Gradio collects concurrent submissions into one call so they share a single QA forward pass.
+
+def _answer(pending_ids):
+    """
+    Batched QA step: answers the question behind every pending id (an empty id means nothing to answer) for finish_answer.
+    Questions and contexts come from the server-side hand-off, and only answers computed here go into the shared answer cache.
+    """
+    jobs = list(pending_questions.claim(pending_ids).items())
+    if jobs:
+        results = get_qa()(question=[question for _, (question, _) in jobs], context=[context for _, (_, context) in jobs], batch_size=len(jobs))
+        if isinstance(results, dict): # The pipeline unwraps single-item batches.
+            results = [results]
+        for (pending_id, (question, context)), result in zip(jobs, results):
+            answer_cache.put(answer_key(question, context), result["answer"])
+            pending_questions.complete(pending_id, result["answer"])
+    return [pending_ids]
 
 # Find the most relevant section in the document
 
-def find_relevant_section(query, sections, section_embeddings):
+def find_relevant_section(query, state):
     """
     1. First, it performs a semantic search using cosine similarity.
     2. If the similarity score is below a threshold, it falls back to a keyword-based search.
+    Returns (section_index, section, similarity_score); the index is None when nothing relevant was found.
     """
     
-    stopwords = {"and", "the", "is", "for", "to", "a", "an", "of", "in", "on", "at", "with", "by", "it", "as", "so", "what"}
+    sections = state['sections']
+    section_embeddings = state['section_embeddings']
     
     # Semantic search
-    query_embedding = embedder.encode(query, convert_to_tensor=True)
-    similarities = util.cos_sim(query_embedding, section_embeddings)[0] # Compute cosine similarity between the query embedding and all section embeddings. 
-    best_idx = similarities.argmax().item()
+    query_embedding = _encode_query(normalize_query(query))
+    similarities = cosine_similarities(query_embedding, section_embeddings, out=state['similarity_buffer']) # Section embeddings are pre-normalized, so this is a single dot product per section.
+    best_idx = int(np.argmax(similarities))
     best_section = sections[best_idx]
-    similarity_score = similarities[best_idx].item()
+    similarity_score = float(similarities[best_idx])
 
-    # Defining a threshold to determine if semantic search is confident enough.
+    # Defining a threshold to determine if semantic search is confident enough, and the margin over the
+    # runner-up below which the match is ambiguous.
     
     SIMILARITY_THRESHOLD = 0.4
+    AMBIGUITY_MARGIN = 0.05
     if similarity_score >= SIMILARITY_THRESHOLD:
-        logger.info(f"Found relevant section using embeddings for query: {query}")
-        return best_section
+        # Two different sections scoring almost the same: the QA model would only be guessing between them.
+        rival_idx = closest_rival(similarities, sections, best_idx, AMBIGUITY_MARGIN)
+        if rival_idx is not None:
+            logger.info("Ambiguous match (%s vs %s) for query: %s", similarity_score, float(similarities[rival_idx]), query)
+            return None, "I don’t have enough information to answer that.", similarity_score
+        logger.info("Found relevant section using embeddings for query: %s", query)
+        return best_idx, best_section, similarity_score
     
-    logger.info(f"Low similarity ({similarity_score}). Falling back to keyword search.")
+    logger.info("Low similarity (%s). Falling back to keyword search.", similarity_score)
     
     # Keyword-based fallback search with stopword filtering
     
-    query_words = {word for word in query.lower().split() if word not in stopwords}
-    for section in sections:
-        section_words = {word for word in section.lower().split() if word not in stopwords}
-        common_words = query_words.intersection(section_words)
+    vectorizer, keyword_matrix = state['keyword_vectorizer'], state['keyword_matrix']
+    query_row = vectorizer.transform([query]) if vectorizer is not None else None
+    
+    # A two-word overlap is impossible with fewer than two known query words, so skip the search.
+    if query_row is not None and query_row.nnz >= 2:
+        overlaps = (keyword_matrix @ query_row.T).toarray().ravel() # Number of shared words with every section in one sparse product.
 
-        # If at least two words match, return this section.
-        
-        if len(common_words) >= 2:
-            logger.info(f"Keyword match found for query: {query} with common words: {common_words}")
-            return section
+        # Return the first section where at least two words match.
+        matches = np.flatnonzero(overlaps >= 2)
+        if matches.size:
+            idx = int(matches[0])
+            common_words = section_word_set(query) & section_word_set(sections[idx])
+            logger.info("Keyword match found for query: %s with common words: %s", query, common_words)
+            return idx, sections[idx], similarity_score
     
-    logger.info(f"No good keyword match found. Returning default fallback response.")
-    return "I don’t have enough information to answer that."
+    logger.info("No good keyword match found. Returning default fallback response.")
+    return None, "I don’t have enough information to answer that.", similarity_score
 
 def process_file(file, state):
     """Handles the uploaded file, processes its text, and prepares it for querying."""
@@ -76,38 +287,74 @@ def process_file(file, state):
         logger.info("No file uploaded.")
         return [("Bot", "Please upload a file.")], state
 
-    # Determine file type and extract text accordingly.
+    # Determine file type and split the document into sections accordingly.
     
     file_path = file.name
     if file_path.lower().endswith(".pdf"):
-        logger.info(f"Uploaded PDF file: {file_path}")
-        text = extract_text_from_pdf(file_path)
+        logger.info("Uploaded PDF file: %s", file_path)
+        sections = list(iter_pdf_sections(file_path))
     elif file_path.lower().endswith(".txt"):
-        logger.info(f"Uploaded TXT file: {file_path}")
+        logger.info("Uploaded TXT file: %s", file_path)
         with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
+            sections = f.read().split('\n\n')
     else:
-        logger.error(f"Unsupported file format: {file_path}")
+        logger.error("Unsupported file format: %s", file_path)
         return [("Bot", "Unsupported file format. Please upload a PDF or TXT file.")], state
 
-    # Split document into sections and encode them into embeddings.
-    sections = text.split('\n\n')
-    section_embeddings = embedder.encode(sections, convert_to_tensor=True)
+    # Encode the sections into embeddings.
+    # Sections seen before (same text and model) are read from the embedding cache; only new ones are encoded.
+    section_embeddings = get_embedding_cache().get_or_compute_many(sections, partial(encode_sections, get_embedder()))
 
-    # Store extracted text and embeddings in the chatbot's state dictionary.  
-    state['document_text'] = text
+    # Store sections and embeddings in the chatbot's state dictionary (the full text is not needed for answering).  
     state['sections'] = sections
-    state['section_embeddings'] = section_embeddings
+    state['keyword_vectorizer'], state['keyword_matrix'] = build_keyword_index(sections)
+    state['section_embeddings'] = search_matrix(section_embeddings)
+    state['similarity_buffer'] = similarity_buffer(state['section_embeddings']) # Reused by every query on this document.
     state['current_query'] = None
     state['feedback_count'] = 0
     state['mode'] = 'waiting_for_query'
     state['chat_history'] = [("Bot", "File processed. You can now ask questions.")]
-    logger.info(f"Processed file: {file_path}")
+    logger.info("Processed file: %s", file_path)
     return state['chat_history'], state
 
 
+def record_answer(state, answer):
+    state['last_answer'] = answer
+    state['mode'] = 'waiting_for_feedback' # Only once there is an answer to give feedback on.
+    state['chat_history'].append(("Bot", f"Answer: {answer}\nPlease provide feedback: good, too vague, not helpful."))
+    logger.info("Query: %s, Answer: %s", state['current_query'], answer)
+
+def record_adjusted_answer(state, adjusted_answer):
+    state['last_answer'] = adjusted_answer
+    state['feedback_count'] += 1
+    state['chat_history'].append(("Bot", f"Updated answer: {adjusted_answer}\nPlease provide feedback: good, too vague, not helpful."))
+    logger.info("Adjusted answer: %s", adjusted_answer)
+
+def queue_question(state, kind, question, section_idx):
+    """
+    Hands a question over to the batched QA step and returns its pending id ("" if there is nothing to answer).
+    If the same question was already answered from this section's text, the cached answer is recorded right away instead.
+    """
+    context = state['sections'][section_idx]
+    cached = answer_cache.get(answer_key(question, context))
+    if cached is not None:
+        if kind == 'answer':
+            record_answer(state, cached)
+        else:
+            record_adjusted_answer(state, cached)
+        return ""
+    pending_id = pending_questions.add(question, context)
+    state['pending'] = (kind, pending_id)
+    return pending_id
+
 def handle_input(user_input, state):
-    """Processes user queries, fetches answers, and handles feedback loops."""
+    """
+    Processes user queries and handles feedback loops.
+    Questions that need the QA model are returned as a pending id for the batched _answer step; finish_answer records the result.
+    """
+
+    state['pending'] = None
+    pending_id = ""
 
     if state['mode'] == 'waiting_for_upload':
         state['chat_history'].append(("Bot", "Please upload a file first."))
@@ -117,27 +364,24 @@ def handle_input(user_input, state):
         query = user_input
         state['current_query'] = query
         state['feedback_count'] = 0
+        state['chat_history'].append(("User", query))
 
         # Finding the best matching section.
-        context = find_relevant_section(query, state['sections'], state['section_embeddings'])
+        section_idx, section, score = find_relevant_section(query, state)
 
-        # Generating an answer using the QA model.
-        if context == "I don’t have enough information to answer that.":
-            answer = context
+        # Generating an answer using the QA model, unless the match is close enough to answer from the section itself.
+        if section_idx is None:
+            record_answer(state, section)
+        elif score >= DIRECT_ANSWER_THRESHOLD:
+            logger.info("High similarity (%s). Answering from the section directly, skipping the QA model.", score)
+            record_answer(state, leading_sentence(section))
         else:
-            result = qa_model(question=query, context=context)
-            answer = result["answer"]
-            
-        state['last_answer'] = answer
-        state['mode'] = 'waiting_for_feedback'
-        state['chat_history'].append(("User", query))
-        state['chat_history'].append(("Bot", f"Answer: {answer}\nPlease provide feedback: good, too vague, not helpful."))
-        logger.info(f"Query: {query}, Answer: {answer}")
+            pending_id = queue_question(state, 'answer', query, section_idx)
         
     elif state['mode'] == 'waiting_for_feedback':
         feedback = user_input.lower()
         state['chat_history'].append(("User", feedback))
-        logger.info(f"Feedback: {feedback}")
+        logger.info("Feedback: %s", feedback)
 
         # Handling feedback responses.
         
@@ -154,32 +398,46 @@ def handle_input(user_input, state):
                 
         else:
             query = state['current_query']
-            context = find_relevant_section(query, state['sections'], state['section_embeddings'])
+            section_idx, section, _ = find_relevant_section(query, state) # "not helpful" always goes through the QA model.
             
             if feedback == "too vague":
-                adjusted_answer = f"{state['last_answer']}\n\n(More details:\n{context[:500]}...)"
+                record_adjusted_answer(state, f"{state['last_answer']}\n\n(More details:\n{section[:500]}...)")
                 
             elif feedback == "not helpful":
-                adjusted_answer = qa_model(question=query + " Please provide more detailed information with examples.", context=context)['answer']
+                if section_idx is None:
+                    record_adjusted_answer(state, section)
+                else:
+                    pending_id = queue_question(state, 'adjusted', query + " Please provide more detailed information with examples.", section_idx)
                 
             else:
                 state['chat_history'].append(("Bot", "Please provide valid feedback: good, too vague, not helpful."))
-                logger.info(f"Invalid feedback received: {feedback}")
-                return state['chat_history'], state
-                
-            state['last_answer'] = adjusted_answer
-            state['feedback_count'] += 1
-            state['chat_history'].append(("Bot", f"Updated answer: {adjusted_answer}\nPlease provide feedback: good, too vague, not helpful."))
-            logger.info(f"Adjusted answer: {adjusted_answer}")
+                logger.info("Invalid feedback received: %s", feedback)
             
+    return state['chat_history'], state, pending_id
+
+def finish_answer(state):
+    """Records the answer the batched QA step computed for this session's pending question, if it was waiting for one."""
+    if state.get('pending') is not None:
+        kind, pending_id = state['pending']
+        state['pending'] = None
+        answer = pending_questions.pop_answer(pending_id)
+        if answer is None: # The QA step failed, so there is no answer to ask feedback on.
+            state['chat_history'].append(("Bot", "Sorry, something went wrong while answering. Please try again."))
+            logger.error("No answer was produced for query: %s", state['current_query'])
+        elif kind == 'answer':
+            record_answer(state, answer)
+        else:
+            record_adjusted_answer(state, answer)
     return state['chat_history'], state
 
 # Function to return the up-to-date log file for download
 
 def get_log_file():
-    # Flush all log handlers to ensure log file is current
-    for handler in logger.handlers:
-        handler.flush()
+    # Restart the listener so every queued record is written and flushed, ensuring the log file is current
+    with log_flush_lock:
+        log_listener.stop()
+        log_file_handler.flush()
+        log_listener.start()
     # Ensure the log file exists; if not, create an empty one.
     if not os.path.exists("support_bot_log.txt"):
         with open("support_bot_log.txt", "w", encoding="utf-8") as f:
@@ -189,9 +447,12 @@ def get_log_file():
 
 # Initial state setup
 initial_state = {
-    'document_text': None,
     'sections': None,
+    'keyword_vectorizer': None,
+    'keyword_matrix': None,
     'section_embeddings': None,
+    'similarity_buffer': None,
+    'pending': None,
     'current_query': None,
     'feedback_count': 0,
     'mode': 'waiting_for_upload',
@@ -212,13 +473,20 @@ with gr.Blocks() as demo:
     user_input = gr.Textbox(label="Your query or feedback")
     submit_btn = gr.Button("Submit")
 
+    # Hidden field carrying the opaque id of a pending question to the batched QA step; the question itself stays on the server.
+    pending_question = gr.Textbox(visible=False)
+
     # Process file upload
     file_upload.upload(process_file, inputs=[file_upload, state], outputs=[chat, state])
 
-    # Handle user input and clear the textbox
-    submit_btn.click(handle_input, inputs=[user_input, state], outputs=[chat, state]).then(lambda: "", None, user_input)
+    # Handle user input, answer any question in a shared batch, then clear the textbox
+    submit_btn.click(handle_input, inputs=[user_input, state], outputs=[chat, state, pending_question]) \
+        .then(_answer, inputs=pending_question, outputs=pending_question, batch=True, max_batch_size=QA_MAX_BATCH_SIZE) \
+        .then(finish_answer, inputs=state, outputs=[chat, state]) \
+        .then(lambda: "", None, user_input)
     
     # Set up download log button
     download_btn.click(fn=get_log_file, inputs=[], outputs=download_file)
 
-demo.launch(share=True)
+if __name__ == "__main__":
+    demo.launch(share=True)
@@ -0,0 +1,220 @@
+import re
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import importlib.util
+import os
+from functools import lru_cache
+import numpy as np
+# torch, transformers, sentence_transformers, sklearn and pymupdf are imported where they are first needed, keeping startup fast and idle memory small.
+
+try:
+    import simsimd # Optional SIMD kernels for the similarity search; numpy is used when it is not installed.
+except ImportError:
+    simsimd = None
+
+# Shared by app.py (Gradio) and support_bot_agent.py (CLI): model loading, section search and logging setup.
+
+def setup_logging(path, format=logging.BASIC_FORMAT):
+    """
+    Routes all logging through a queue: handlers only enqueue records, and a background listener thread writes them to `path`.
+    Returns (listener, file_handler); the listener is stopped at exit, draining pending records.
+    """
+    file_handler = logging.FileHandler(path)
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=format, # Applied by the QueueHandler, so timestamps reflect when the event happened.
+        handlers=[QueueHandler(log_queue)],
+        force=True  # Ensures any existing handlers are replaced and logging starts fresh
+    )
+    return listener, file_handler
+
+# Common stopwords ignored by the keyword fallback search.
+STOPWORDS = frozenset({"and", "the", "is", "for", "to", "a", "an", "of", "in", "on", "at", "with", "by", "it", "as", "so", "what"})
+# Matches a stopword only as a whole whitespace-separated token, so removing matches equals filtering the split() words.
+STOPWORD_RE = re.compile(r'(?<!\S)(?:' + '|'.join(re.escape(word) for word in sorted(STOPWORDS)) + r')(?!\S)')
+
+# Semantic matches at least this close are usually the exact FAQ entry, so the section is answered directly without the QA model.
+DIRECT_ANSWER_THRESHOLD = 0.75
+
+QA_MODEL_ID = "distilbert-base-uncased-distilled-squad"
+EMBEDDER_MODEL_ID = "all-MiniLM-L6-v2"
+QA_INT8_DIR = os.path.join("onnx_models", "distilbert-qa-int8") # Where the quantized QA model is exported to on first run.
+EMBEDDER_ONNX_FILE = "onnx/model_qint8_avx512_vnni.onnx" # int8 export published with the embedder, used on CPU.
+
+# Dynamic int8 ONNX models are used when optimum[onnxruntime] is installed; otherwise the FP32 PyTorch models are loaded.
+ONNX_AVAILABLE = importlib.util.find_spec("optimum") is not None and importlib.util.find_spec("onnxruntime") is not None
+
+# Both models are pinned to one explicit device: the GPU when there is one, otherwise the CPU (which also keeps
+# sentence-transformers from probing CUDA). Similarity search runs in numpy on the host, so each encode() makes a
+# single device-to-host copy of its result.
+@lru_cache(maxsize=1)
+def device():
+    """The device both models run on: "cuda" when a GPU is available, else "cpu"."""
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def load_qa_model():
+    """Loads the QA pipeline on the GPU when available; on CPU it is exported and int8-quantized with ONNX Runtime when possible."""
+    from transformers import AutoTokenizer, pipeline
+
+    if device() == "cuda":
+        return pipeline("question-answering", model=QA_MODEL_ID, device=0)
+    if not ONNX_AVAILABLE:
+        return pipeline("question-answering", model=QA_MODEL_ID, device=-1)
+
+    from optimum.onnxruntime import ORTModelForQuestionAnswering, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    if not os.path.exists(os.path.join(QA_INT8_DIR, "model_quantized.onnx")):
+        onnx_model = ORTModelForQuestionAnswering.from_pretrained(QA_MODEL_ID, export=True)
+        quantizer = ORTQuantizer.from_pretrained(onnx_model)
+        quantizer.quantize(save_dir=QA_INT8_DIR, quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False))
+    model = ORTModelForQuestionAnswering.from_pretrained(QA_INT8_DIR, file_name="model_quantized.onnx")
+    return pipeline("question-answering", model=model, tokenizer=AutoTokenizer.from_pretrained(QA_MODEL_ID))
+
+def load_embedder():
+    """Loads the sentence embedder in eval mode, using the int8 ONNX export published with the model when available (outputs stay float32)."""
+    from sentence_transformers import SentenceTransformer
+
+    if not ONNX_AVAILABLE or device() != "cpu": # The int8 ONNX export is a CPU optimization.
+        embedder = SentenceTransformer(EMBEDDER_MODEL_ID, device=device())
+    else:
+        embedder = SentenceTransformer(EMBEDDER_MODEL_ID, device=device(), backend="onnx", model_kwargs={"file_name": EMBEDDER_ONNX_FILE})
+    embedder.eval()
+    return embedder
+
+# Document loading
+
+def page_text(page):
+    # get_text() ends pages with a newline, which is stripped so pages join exactly as before.
+    return page.get_text().rstrip("\n") + "\n"
+
+def iter_pdf_sections(file_path):
+    """
+    Yields the PDF's sections (paragraphs separated by a blank line) page by page, so the whole document text is never held at once.
+    The result is identical to joining every page's text and splitting on '\n\n'. Pages are parsed natively by MuPDF, serially:
+    at about a millisecond per dense page, worker processes (which re-import the entry point) would cost more than they save.
+    """
+    import pymupdf
+
+    buffer = ""
+    with pymupdf.open(file_path) as doc:
+        for page in doc:
+            buffer += page_text(page)
+            *complete, buffer = buffer.split('\n\n') # The last piece may continue on the next page.
+            yield from complete
+    yield buffer
+
+# Encoding
+
+def normalize_query(text):
+    """Normalizes a query into a cache key (both models are uncased, so this does not change their output)."""
+    return " ".join(text.lower().split())
+
+def embed_single(embedder, text):
+    """
+    Embeds one text by calling the underlying transformer directly (tokenize, forward, mean-pool, normalize),
+    skipping encode()'s per-call batching and conversion overhead. Same result as encode(..., normalize_embeddings=True)
+    for all-MiniLM-L6-v2, which uses mean pooling.
+    """
+    import torch
+
+    features = embedder.tokenizer(text, return_tensors='pt', truncation=True, max_length=embedder.max_seq_length).to(embedder.device)
+    with torch.inference_mode(): # Grad mode is per-thread, so it is disabled here rather than once at startup.
+        token_embeddings = embedder[0].auto_model(**features).last_hidden_state
+        mask = features['attention_mask'].unsqueeze(-1).to(token_embeddings.dtype)
+        pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return torch.nn.functional.normalize(pooled, dim=1)[0].cpu().numpy().astype(np.float32, copy=False)
+
+def embed_query(embedder, query_norm):
+    """Encodes a normalized query into a unit-length float32 vector."""
+    # Single queries bypass encode() when the embedder runs on PyTorch; the int8 ONNX backend keeps using encode().
+    if getattr(embedder, "backend", "torch") == "torch":
+        return embed_single(embedder, query_norm)
+    return embedder.encode(query_norm, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32, copy=False)
+
+def encode_sections(embedder, sections):
+    # encode() already groups sections of similar length into each batch; normalizing here means queries only need a dot product.
+    return embedder.encode(sections, batch_size=32, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32, copy=False)
+
+# Similarity search on unit-normalized embeddings
+
+def quantize_int8(vectors):
+    """Symmetric int8 quantization, scaling each vector so its largest component maps to 127 (cosine ignores the scale)."""
+    scale = 127 / np.maximum(np.abs(vectors).max(axis=-1, keepdims=True), 1e-12)
+    return np.clip(np.round(vectors * scale), -127, 127).astype(np.int8)
+
+def search_matrix(section_embeddings):
+    """
+    Prepares normalized section embeddings for similarity search: int8 for simsimd's int8 cosine kernel
+    (a quarter of the memory traffic), or C-contiguous float32 for numpy, whose int8 dot products would overflow.
+    """
+    if simsimd is not None:
+        return quantize_int8(section_embeddings)
+    return np.ascontiguousarray(section_embeddings, dtype=np.float32)
+
+def cosine_similarities(query_vec, section_matrix, out=None):
+    """
+    Returns the cosine similarity between a normalized query vector and every section row of a search_matrix().
+    Without simsimd this is a single float32 GEMV, written into `out` (a float32 buffer of one slot per section) when given.
+    """
+    if section_matrix.dtype == np.int8:
+        return 1 - np.asarray(simsimd.cdist(quantize_int8(query_vec)[None, :], section_matrix, metric="cosine"))[0]
+    return np.dot(section_matrix, query_vec, out=out)
+
+def similarity_buffer(section_matrix):
+    """A reusable `out` buffer for cosine_similarities() on a float32 matrix; None for int8, where simsimd returns its own array."""
+    return np.empty(len(section_matrix), dtype=np.float32) if section_matrix.dtype == np.float32 else None
+
+def closest_rival(scores, sections, best_idx, margin):
+    """
+    Returns the index of the best-scoring section whose text differs from sections[best_idx], if it scores within `margin`
+    of the winner, else None. Duplicates of the winning section are skipped, so they never hide a different near-tie.
+    Only the sections within the margin have their text compared.
+    """
+    best_section = sections[best_idx]
+    close = np.flatnonzero(scores > scores[best_idx] - margin)
+    rivals = [int(i) for i in close if sections[i] != best_section]
+    return max(rivals, key=lambda i: scores[i]) if rivals else None
+
+# Keyword fallback
+
+def keyword_tokens(text):
+    """Lowercased non-stopword words of a text; stopwords are removed in one compiled-regex pass."""
+    return STOPWORD_RE.sub('', text.lower()).split()
+
+def section_word_set(section):
+    """Returns the set of lowercased, non-stopword words in a section, used by the keyword fallback."""
+    return frozenset(keyword_tokens(section))
+
+def build_keyword_index(sections):
+    """
+    Builds a binary (sections x vocabulary) sparse matrix of non-stopword words for the keyword fallback.
+    Tokenization is keyword_tokens, as in section_word_set. Returns (None, None) if no section has any keyword.
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    vectorizer = CountVectorizer(tokenizer=keyword_tokens, lowercase=False, token_pattern=None, binary=True, dtype=np.int32)
+    try:
+        return vectorizer, vectorizer.fit_transform(sections).tocsr()
+    except ValueError: # Empty vocabulary: every section is blank or only stopwords.
+        return None, None
+
+# Answering
+
+def leading_sentence(section):
+    """First sentence of a section's answer text, skipping leading FAQ question lines (ending in '?')."""
+    lines = section.strip().splitlines()
+    if not lines: # A blank section (e.g. after a trailing blank line) has nothing to answer with.
+        return "I don’t have enough information to answer that."
+    while len(lines) > 1 and lines[0].rstrip().endswith('?'):
+        lines = lines[1:]
+    sentence = " ".join(line.strip() for line in lines).split('. ')[0].strip()
+    return sentence if sentence.endswith(('.', '!', '?')) else sentence + '.'
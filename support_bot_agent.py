@@ -1,113 +1,142 @@
 import logging
-from transformers import pipeline
-from sentence_transformers import SentenceTransformer, util
-import PyPDF2
+from functools import lru_cache
+import numpy as np
+from retrieval import (DIRECT_ANSWER_THRESHOLD, build_keyword_index, closest_rival, cosine_similarities, embed_query,
+                       encode_sections, iter_pdf_sections, leading_sentence, load_embedder, load_qa_model, normalize_query,
+                       search_matrix, section_word_set, setup_logging, similarity_buffer)
 
-# Set up logging to record actions
-logging.basicConfig(filename='support_bot_log.txt', level=logging.INFO)
+# Set up logging to record actions; records are written to the file by a background listener thread
+setup_logging('support_bot_log.txt')
 
 
 class SupportBotAgent:
     def __init__(self, document_path):
         # Load a pre-trained question-answering model
-        self.qa_model = pipeline("question-answering", model="distilbert-base-uncased-distilled-squad")
+        self.qa_model = load_qa_model()
         
         # Set up an embedding model for finding relevant sections
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedder = load_embedder()
         
-        # Load the document text and split it into sections (by paragraphs)
-        self.document_text = self.load_document(document_path)
-        self.sections = self.document_text.split('\n\n')
+        # Load the document and split it into sections (by paragraphs)
+        self.sections = self.load_sections(document_path)
+        # Tokenize once here so the keyword fallback is a single sparse product per query.
+        self.keyword_vectorizer, self.keyword_matrix = build_keyword_index(self.sections)
 
         # Generate embeddings for all sections to enable fast similarity search.
-        self.section_embeddings = self.embedder.encode(self.sections, convert_to_tensor=True)
-        logging.info(f"Loaded document: {document_path}")
-
-    def load_document(self, path):
-        """Loads and extracts text from a given document (TXT or PDF) and logs it in the log file."""
+        # Repeated sections (headers, footers, boilerplate) are encoded once and their row is shared.
+        # Rows come back unit-normalized, so each query only needs a dot product against this matrix.
+        unique_index = {section: i for i, section in enumerate(dict.fromkeys(self.sections))}
+        unique_embeddings = encode_sections(self.embedder, list(unique_index))
+        self._sec_mat = search_matrix(unique_embeddings[[unique_index[section] for section in self.sections]])
+        logging.info("Encoded %s unique of %s sections", len(unique_index), len(self.sections))
+        self._sim_buf = similarity_buffer(self._sec_mat) # Reused by every query's similarity search.
+
+        # Per-document caches: repeated queries skip the embedder, repeated (query, section) pairs skip the QA model.
+        self._encode_query = lru_cache(maxsize=1024)(self._embed_query)
+        self._qa = lru_cache(maxsize=512)(self._run_qa)
+        logging.info("Loaded document: %s", document_path)
+
+    def load_sections(self, path):
+        """Loads a given document (TXT or PDF), splits it into sections (paragraphs separated by a blank line) and logs it in the log file."""
             
         if path.lower().endswith(".txt"):
             file_type = "Text File"
             with open(path, 'r', encoding='utf-8') as file:
-                text = file.read()
+                sections = file.read().split('\n\n')
         
         elif path.lower().endswith(".pdf"):
             file_type = "PDF File"
-            text = ""
-            with open(path, "rb") as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
+            sections = list(iter_pdf_sections(path))
         
         else:
             file_type = "Unsupported Format"
-            logging.error(f"Unsupported file format: {path}")
+            logging.error("Unsupported file format: %s", path)
             raise ValueError("Unsupported file format. Please provide a TXT or PDF file.")
         
         # Log file type detection
-        logging.info(f"Loaded {file_type}: {path}")
+        logging.info("Loaded %s: %s", file_type, path)
         
-        return text
+        return sections
+
+    def _embed_query(self, query_norm):
+        """Encodes a normalized query into a unit-length vector (wrapped by the per-instance LRU cache)."""
+        return embed_query(self.embedder, query_norm)
+
+    def _run_qa(self, query_norm, section_idx):
+        """Extracts the answer span for a normalized query from a section (wrapped by the per-instance LRU cache)."""
+        # The QA model is uncased, so the normalized query gives the same answer as the original.
+        return self.qa_model(question=query_norm, context=self.sections[section_idx], max_answer_len=50)["answer"]
 
     def find_relevant_section(self, query):
         """
         First tries semantic similarity (sentence-transformers).
         If similarity is too low, falls back to keyword search with stricter matching using stopword filtering.
+        Returns (section_index, section, similarity_score); the index is None when nothing relevant was found.
         """
 
-        # Predefined list of common stopwords (you can expand this list)
-        stopwords = {"and", "the", "is", "for", "to", "a", "an", "of", "in", "on", "at", "with", "by", "it", "as", "so", "what"}
-        
         # Semantic search part
-        query_embedding = self.embedder.encode(query, convert_to_tensor=True)
-        similarities = util.cos_sim(query_embedding, self.section_embeddings)[0]
-        best_idx = similarities.argmax().item()
+        query_embedding = self._encode_query(normalize_query(query))
+        similarities = cosine_similarities(query_embedding, self._sec_mat, out=self._sim_buf)
+        best_idx = int(np.argmax(similarities))
         best_section = self.sections[best_idx]
-        similarity_score = similarities[best_idx].item()
+        similarity_score = float(similarities[best_idx])
         
-        # Threshold for semantic search confidence
+        # Threshold for semantic search confidence, and the margin over the runner-up below which the match is ambiguous
         SIMILARITY_THRESHOLD = 0.4
+        AMBIGUITY_MARGIN = 0.05
 
         if similarity_score >= SIMILARITY_THRESHOLD:
-            logging.info(f"Found relevant section using embeddings for query: {query}")
-            return best_section
-
-        logging.info(f"Low similarity ({similarity_score}). Falling back to keyword search.")
+            # Two different sections scoring almost the same: the QA model would only be guessing between them.
+            rival_idx = closest_rival(similarities, self.sections, best_idx, AMBIGUITY_MARGIN)
+            if rival_idx is not None:
+                logging.info("Ambiguous match (%s vs %s) for query: %s", similarity_score, float(similarities[rival_idx]), query)
+                return None, "I don’t have enough information to answer that.", similarity_score
+            logging.info("Found relevant section using embeddings for query: %s", query)
+            return best_idx, best_section, similarity_score
+
+        logging.info("Low similarity (%s). Falling back to keyword search.", similarity_score)
         
         # Keyword-based fallback search with stopword filtering
-        query_words = {word for word in query.lower().split() if word not in stopwords}
-        for section in self.sections:
-            section_words = {word for word in section.lower().split() if word not in stopwords}
-            common_words = query_words.intersection(section_words)
-            
-            # Only consider it a match if there are at least 2 significant words overlapping
-            if len(common_words) >= 2:
-                logging.info(f"Keyword match found for query: {query} with common words: {common_words}")
-                return section
+        query_row = self.keyword_vectorizer.transform([query]) if self.keyword_vectorizer is not None else None
 
-        logging.info(f"No good keyword match found. Returning default fallback response.")
+        # A two-word overlap is impossible with fewer than two known query words, so skip the search.
+        if query_row is not None and query_row.nnz >= 2:
+            overlaps = (self.keyword_matrix @ query_row.T).toarray().ravel()
+            
+            # Only consider it a match if there are at least 2 significant words overlapping; keep the first such section
+            matches = np.flatnonzero(overlaps >= 2)
+            if matches.size:
+                idx = int(matches[0])
+                common_words = section_word_set(query) & section_word_set(self.sections[idx])
+                logging.info("Keyword match found for query: %s with common words: %s", query, common_words)
+                return idx, self.sections[idx], similarity_score
+
+        logging.info("No good keyword match found. Returning default fallback response.")
         
-        return "I don’t have enough information to answer that."
+        return None, "I don’t have enough information to answer that.", similarity_score
 
 
-    def answer_query(self, query):
+    def answer_query(self, query, force_qa=False):
         """
         Answers a user query by:
         - Finding the most relevant section.
-        - Using a question-answering model to extract the exact answer.
+        - Using a question-answering model to extract the exact answer,
+          or answering from the section directly on a very close match (unless force_qa is set).
         """
-        context = self.find_relevant_section(query)
+        section_idx, section, score = self.find_relevant_section(query)
 
         # If no relevant context is found, return a default response.
-        if not context:
+        if section_idx is None:
             answer = "I don’t have enough information to answer that."
+        elif score >= DIRECT_ANSWER_THRESHOLD and not force_qa:
+            logging.info("High similarity (%s). Answering from the section directly, skipping the QA model.", score)
+            answer = leading_sentence(section)
         else:
-            # Run the QA model to extract the most relevant answer span.
-            result = self.qa_model(question=query, context=context, max_answer_len=50)
-            answer = result["answer"]
+            # Run the QA model to extract the most relevant answer span, unless this exact question was already answered from this section.
+            answer = self._qa(normalize_query(query), section_idx)
         
         # Log the answer for transparency
-        logging.info(f"Answer for query '{query}': {answer}")
+        logging.info("Answer for query '%s': %s", query, answer)
         return answer
 
     def get_feedback(self, response):
@@ -120,27 +149,27 @@ class SupportBotAgent:
         """
         
         feedback = input("Enter feedback (good, too vague, not helpful): ").strip().lower()
-        logging.info(f"Feedback provided: {feedback}")
+        logging.info("Feedback provided: %s", feedback)
         return feedback
 
     def adjust_response(self, query, response, feedback):
-          """
+        """
         Modifies the response based on user feedback.
         - If 'too vague', appends more context.
         - If 'not helpful', re-queries with a modified prompt.
         """
         
         if feedback == "too vague":
-            context = self.find_relevant_section(query)
+            _, context, _ = self.find_relevant_section(query)
             adjusted_response = f"{response}\n\n(More details:\n{context[:500]}...)"
             
         elif feedback == "not helpful":
-            adjusted_response = self.answer_query(query + " Please provide more detailed information with examples.")
+            adjusted_response = self.answer_query(query + " Please provide more detailed information with examples.", force_qa=True)
             
         else:
             adjusted_response = response
         
-        logging.info(f"Adjusted answer for query '{query}': {adjusted_response}")
+        logging.info("Adjusted answer for query '%s': %s", query, adjusted_response)
         return adjusted_response
 
     def run(self):
@@ -157,7 +186,7 @@ class SupportBotAgent:
             
             if query.lower() == 'exit':
                 break
-            logging.info(f"Processing query: {query}")
+            logging.info("Processing query: %s", query)
 
             # Generate an answer based on document context.
             response = self.answer_query(query)